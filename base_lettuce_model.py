@@ -1,65 +1,167 @@
 from typing import Dict, List, Tuple, Optional, Callable
+import math
 import numpy as np
 import numpy.typing as npt
-from numba import jit
+from numba import njit
 from pathlib import Path
 
-@jit(nopython=True)
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
 def _beer_lambert(lai: float, k: float) -> float:
     """Beer-Lambert law calculation with jit"""
-    return -np.exp(-k * lai) + 1
+    return 1.0 - math.exp(-k * lai)
 
-@jit(nopython=True)
-def _model_core(x, u, params_array, light_interception_method: int):
-    """Core differential equations with jit
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _precompute_action(u, params_array):
+    """Terms of the right-hand side that depend on the action only
     
-    Args:
-        light_interception_method: Integer flag for method selection
-            0: Beer-Lambert (default)
-            1: External value (passed through params_array[-1])
+    Computed once per step and shared by all four RK4 stages, so the
+    stages only evaluate the state-dependent part of the model.
+    
+    Returns:
+        tuple: (pd, photo_max, rgr_max, c_r, resp_coef, growth_resp, lai_coef, c_k)
     """
-    t, r, co2, pd = u
-    x = x * pd 
+    t, r, co2, pd = u[0], u[1], u[2], u[3]
     # Unpack parameters (keep last element for external light interception)
-    c_R, c_Q10_R = params_array[0:2]
-    c_epsilon, c_w = params_array[2:4]
-    g_bnd, g_stm = params_array[4:6]
-    c_car_1, c_car_2, c_car_3 = params_array[6:9]
-    c_gr_max, c_r = params_array[9:11]
-    c_resp_sht, c_resp_rt = params_array[11:13]
-    c_Q10_gr, c_Q10_resp = params_array[13:15]
-    c_t, c_k, c_lar = params_array[15:18]
-    c_a, c_b = params_array[18:20]
-    external_li = params_array[20]  # External light interception if used
-    # print(f"external_li: {float(external_li)}")
+    c_R = params_array[0]
+    c_epsilon, c_w = params_array[2], params_array[3]
+    g_bnd, g_stm = params_array[4], params_array[5]
+    c_car_1, c_car_2, c_car_3 = params_array[6], params_array[7], params_array[8]
+    c_gr_max, c_r = params_array[9], params_array[10]
+    c_resp_sht, c_resp_rt = params_array[11], params_array[12]
+    c_t, c_k, c_lar = params_array[15], params_array[16], params_array[17]
+    c_a, c_b = params_array[18], params_array[19]
+    log_Q10_R, log_Q10_gr, log_Q10_resp = params_array[20], params_array[21], params_array[22]
+    
     # Calculate photosynthesis parameters
-    R = c_R * c_Q10_R ** ((t - 20) / 10)
+    R = c_R * math.exp((t - 20) * 0.1 * log_Q10_R)
     lue = c_epsilon * (co2 - R) / (co2 + 2 * R)
-    g_co2 = 1 / (1/g_bnd + 1/g_stm + 1/(c_car_1 * t**2 + c_car_2 * t + c_car_3))
-    # Calculate light interception based on method
-    if light_interception_method == 0:  # Beer-Lambert
-        lai = c_lar * (1 - c_t) * x[1]
-        light_interception = _beer_lambert(lai, c_k)
-    else:  # External value
-        light_interception = external_li
-    # Rest of the calculations
+    g_co2 = 1 / (1/g_bnd + 1/g_stm + 1/(c_car_1 * t * t + c_car_2 * t + c_car_3))
     f_photo_max = ((lue * r * g_co2 * c_w * (co2 - R)) / 
                    (lue * r + g_co2 * c_w * (co2 - R)))
-    f_photo = f_photo_max * light_interception
     
-    rgr = (c_gr_max * (x[0] / (c_r * x[1] + x[0])) * 
-           c_Q10_gr ** ((t - 20) / 10))
-    f_resp = ((c_resp_sht * (1 - c_t) * x[1] + 
-               c_resp_rt * c_t * x[1]) * 
-              c_Q10_resp ** ((t - 25) / 10))
+    photo_max = c_a * f_photo_max
+    rgr_max = c_gr_max * math.exp((t - 20) * 0.1 * log_Q10_gr)
+    resp_coef = ((c_resp_sht * (1 - c_t) + c_resp_rt * c_t) * 
+                 math.exp((t - 25) * 0.1 * log_Q10_resp))
+    growth_resp = (1 - c_b) / c_b
+    lai_coef = c_lar * (1 - c_t)
+    return pd, photo_max, rgr_max, c_r, resp_coef, growth_resp, lai_coef, c_k
+
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _derivatives(x0, x1, precomp, light_interception: float):
+    """State-dependent part of the right-hand side for one RK4 stage
+    
+    Returns:
+        tuple: (dx0/dt, dx1/dt) per plant
+    """
+    pd, photo_max, rgr_max, c_r, resp_coef, growth_resp = precomp[:6]
+    x0 = x0 * pd
+    x1 = x1 * pd
+    
+    rgr = rgr_max * (x0 / (c_r * x1 + x0))
+    f_resp = resp_coef * x1
     
-    ki = np.array([
-        c_a * f_photo - rgr * x[1] - f_resp - 
-        (1 - c_b) / c_b * rgr * x[1],
-        rgr * x[1]
-    ])
+    k0 = (photo_max * light_interception - rgr * x1 - f_resp - 
+          growth_resp * rgr * x1)
+    k1 = rgr * x1
+    return k0 / pd, k1 / pd
+
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _stage_beer(x0, x1, precomp):
+    """RK4 stage with Beer-Lambert light interception from the canopy LAI"""
+    pd, lai_coef, c_k = precomp[0], precomp[6], precomp[7]
+    light_interception = _beer_lambert(lai_coef * x1 * pd, c_k)
+    return _derivatives(x0, x1, precomp, light_interception)
+
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _stage_external(x0, x1, precomp, external_li: float):
+    """RK4 stage with externally supplied light interception"""
+    return _derivatives(x0, x1, precomp, external_li)
+
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _rk4_step_beer(state, u, params_array, h: float):
+    """Advance state in place by one RK4 step, Beer-Lambert light interception
     
-    return ki / pd
+    Args:
+        state: Plant state per plant, updated in place
+        u: Action (temperature, radiation, CO2, plant density)
+        h: Timestep in seconds
+    """
+    precomp = _precompute_action(u, params_array)
+    
+    s0, s1 = state[0], state[1]
+    # only the latest stage derivative and the running sum k1 + 2*k2 + 2*k3 + k4 are kept
+    d0, d1 = _stage_beer(s0, s1, precomp)
+    acc0, acc1 = d0, d1
+    d0, d1 = _stage_beer(s0 + h/2 * d0, s1 + h/2 * d1, precomp)
+    acc0 += 2 * d0
+    acc1 += 2 * d1
+    d0, d1 = _stage_beer(s0 + h/2 * d0, s1 + h/2 * d1, precomp)
+    acc0 += 2 * d0
+    acc1 += 2 * d1
+    d0, d1 = _stage_beer(s0 + h * d0, s1 + h * d1, precomp)
+    acc0 += d0
+    acc1 += d1
+    
+    state[0] = s0 + h/6 * acc0
+    state[1] = s1 + h/6 * acc1
+
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _rk4_step_external(state, u, params_array, h: float):
+    """Advance state in place by one RK4 step, external light interception (params_array[-1])
+    
+    Args:
+        state: Plant state per plant, updated in place
+        u: Action (temperature, radiation, CO2, plant density)
+        h: Timestep in seconds
+    """
+    precomp = _precompute_action(u, params_array)
+    external_li = params_array[23]  # External light interception
+    
+    s0, s1 = state[0], state[1]
+    # only the latest stage derivative and the running sum k1 + 2*k2 + 2*k3 + k4 are kept
+    d0, d1 = _stage_external(s0, s1, precomp, external_li)
+    acc0, acc1 = d0, d1
+    d0, d1 = _stage_external(s0 + h/2 * d0, s1 + h/2 * d1, precomp, external_li)
+    acc0 += 2 * d0
+    acc1 += 2 * d1
+    d0, d1 = _stage_external(s0 + h/2 * d0, s1 + h/2 * d1, precomp, external_li)
+    acc0 += 2 * d0
+    acc1 += 2 * d1
+    d0, d1 = _stage_external(s0 + h * d0, s1 + h * d1, precomp, external_li)
+    acc0 += d0
+    acc1 += d1
+    
+    state[0] = s0 + h/6 * acc0
+    state[1] = s1 + h/6 * acc1
+
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _rk4_many_beer(state, actions, params_array, h: float, out_traj):
+    """Advance state in place over a sequence of actions with _rk4_step_beer
+    
+    Args:
+        state: Plant state per plant, updated in place
+        actions: Array of shape (N, 4), one action per timestep
+        out_traj: Preallocated array of shape (N, 2) receiving the state after each step
+    """
+    for i in range(actions.shape[0]):
+        _rk4_step_beer(state, actions[i], params_array, h)
+        out_traj[i, 0] = state[0]
+        out_traj[i, 1] = state[1]
+
+@njit(cache=True, fastmath=True, boundscheck=False, error_model='numpy')
+def _rk4_many_external(state, actions, params_array, h: float, out_traj):
+    """Advance state in place over a sequence of actions with _rk4_step_external
+    
+    Args:
+        state: Plant state per plant, updated in place
+        actions: Array of shape (N, 4), one action per timestep
+        out_traj: Preallocated array of shape (N, 2) receiving the state after each step
+    """
+    for i in range(actions.shape[0]):
+        _rk4_step_external(state, actions[i], params_array, h)
+        out_traj[i, 0] = state[0]
+        out_traj[i, 1] = state[1]
 
 class BaseLettuceMechanisticModel:
     def __init__(self,
@@ -89,6 +191,12 @@ class BaseLettuceMechanisticModel:
         
         # Initialize parameters array with space for external light interception
         self._init_params_array()
+        
+        # Pick the kernels specialized for the light interception method once
+        if light_interception_method == 0:
+            self._rk4_step, self._rk4_many = _rk4_step_beer, _rk4_many_beer
+        else:
+            self._rk4_step, self._rk4_many = _rk4_step_external, _rk4_many_external
 
     def _init_params_array(self):
         """Convert parameters dictionary to array for Numba"""
@@ -101,8 +209,11 @@ class BaseLettuceMechanisticModel:
                 'c_t', 'c_k', 'c_lar', 'c_a', 'c_b'
             ]
         ])
+        # Natural logs of the Q10 factors, so the kernels evaluate Q10**x as exp(x * log(Q10))
+        log_q10 = np.log([self.parameters[k] for k in ['c_Q10_R', 'c_Q10_gr', 'c_Q10_resp']])
         # 添加外部光截获参数
-        self.params_array = np.append(self.params_array, self._external_light_interception)
+        self.params_array = np.concatenate(
+            (self.params_array, log_q10, [self._external_light_interception]))
 
     def set_external_light_interception(self, value: float):
         """Set external light interception value"""
@@ -115,17 +226,20 @@ class BaseLettuceMechanisticModel:
 
     def step(self, action: np.ndarray) -> None:
         """Advance model state by one timestep using RK4 method"""
-        # Determine method flag
+        self._rk4_step(self.state, action, self.params_array, self.h)
+
+    def step_many(self, actions: np.ndarray) -> np.ndarray:
+        """Advance model state over a sequence of actions in a single compiled loop
         
-        method_flag = self.light_interception_method
-        # print(f"method_flag: {method_flag}")
-        # RK4 integration
-        k1 = _model_core(self.state, action, self.params_array, method_flag)
-        k2 = _model_core(self.state + self.h/2 * k1, action, self.params_array, method_flag)
-        k3 = _model_core(self.state + self.h/2 * k2, action, self.params_array, method_flag)
-        k4 = _model_core(self.state + self.h * k3, action, self.params_array, method_flag)
+        Args:
+            actions: Array of shape (N, 4), one action per timestep
         
-        self.state += self.h/6 * (k1 + 2*k2 + 2*k3 + k4) 
+        Returns:
+            Array of shape (N, 2) with the state after each timestep
+        """
+        trajectory = np.empty((actions.shape[0], 2))
+        self._rk4_many(self.state, actions, self.params_array, self.h, trajectory)
+        return trajectory
 
     def _validate_inputs(self, plant_dw: float, plant_density: int, parameters: Dict[str, float]) -> None:
         """Validate input parameters
@@ -3,8 +3,16 @@ import base64
 from PIL import Image
 import io
 import os 
-import json
+import orjson
 import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
 
 class UnityCommunication:
@@ -13,20 +21,36 @@ class UnityCommunication:
                  port = 5555, 
                  save_dir = "output_image",
                  image_width = 512,
-                 image_height = 512):
+                 image_height = 512,
+                 verbose = False):
         self.unity_ip = ip
         self.unity_port = port
         self.save_dir = save_dir
         self.image_width = image_width
         self.image_height = image_height
         
+        # per-step diagnostics are logged at DEBUG, only shown when verbose
+        if verbose:
+            log.setLevel(logging.DEBUG)
+            if not log.handlers:
+                log.addHandler(logging.StreamHandler())
+        
         # check or create the save_dir
         if not os.path.exists(self.save_dir):
             os.makedirs(self.save_dir)
             
+        # background workers for image decoding and disk writes
+        self._io_pool = ThreadPoolExecutor(max_workers=2)
+        # one reusable decode buffer per io worker, created on first use
+        self._io_buffers = threading.local()
+        
         # ============ zeromq config ============
+        # DEALER instead of REQ so render requests can be pipelined while the
+        # simulation keeps stepping, unity stays a plain REP socket
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REQ)
+        self.socket = self.context.socket(zmq.DEALER)
+        # steps of render requests sent but not answered yet, replies come back in order
+        self._pending = deque()
         self.socket.connect(f"tcp://{self.unity_ip}:{self.unity_port}")
         print(f"Python connected to unity zeromq sever at {self.unity_ip}:{self.unity_port}")
         
@@ -34,49 +58,67 @@ class UnityCommunication:
         self.perform_handshake()
         self.initialize_unity()
         
+    def _send(self, data):
+        """send one json message, the empty frame stands in for the REQ envelope
+        
+        copy=False hands the bytes to zmq without a copy, pyzmq still copies
+        frames below socket.copy_threshold where that is cheaper
+        """
+        self.socket.send_multipart([b"", orjson.dumps(data)], copy=False)
+        
+    def _recv(self, timeout=-1):
+        """receive one reply as its frames after the envelope, None on timeout (ms)
+        
+        frames are memoryviews over the zmq message buffers, no copy is made
+        """
+        if not self.socket.poll(timeout):
+            return None
+        return [frame.buffer for frame in self.socket.recv_multipart(copy=False)[1:]]
+        
     def perform_handshake(self):
         """perform handshake with unity"""
-        max_retries = 10
-        retry_delay = 1.0  # second
+        # about 40 seconds of patience in total for unity to start up, the wait
+        # returns as soon as the reply arrives so a short timeout costs nothing
+        max_retries = 40
+        wait_timeout = 1000  # ms per attempt
+        retry_delay = 0.25  # second, pause before resending after a failure reply
         
+        # the DEALER queues the handshake until unity is listening, so it is only
+        # resent after an explicit failure reply, never after a timeout
+        need_send = True
         for attempt in range(max_retries):
             try:
                 print(f"[Python] Attempting handshake (attempt {attempt + 1}/{max_retries})...")
                 
-                # send handshake request
-                handshake_data = {
-                    "message_type": "handshake"
-                }
-                
-                self.socket.send_string(json.dumps(handshake_data))
+                if need_send:
+                    # send handshake request
+                    handshake_data = {
+                        "message_type": "handshake"
+                    }
+                    self._send(handshake_data)
+                    need_send = False
                 
-                # 设置接收超时
-                self.socket.setsockopt(zmq.RCVTIMEO, 3000)  # 3秒超时
-                
-                try:
-                    response_str = self.socket.recv_string()
-                    response = json.loads(response_str)
+                frames = self._recv(timeout=wait_timeout)
+                if frames is None:
+                    print(f"[Python] Handshake timeout on attempt {attempt + 1}")
+                else:
+                    response = orjson.loads(frames[0])
                     
                     if response.get('status') == 'success' or response.get('status') == 'ok':
                         print(f"[Python] Handshake successful: {response.get('message', 'Connected')}")
-                        # clear timeout setting
-                        self.socket.setsockopt(zmq.RCVTIMEO, -1)
                         return
                     else:
                         print(f"[Python] Handshake failed: {response}")
-                        
-                except zmq.Again:
-                    print(f"[Python] Handshake timeout on attempt {attempt + 1}")
+                        need_send = True
                     
             except Exception as e:
                 print(f"[Python] Handshake error on attempt {attempt + 1}: {e}")
+                need_send = True
             
-            if attempt < max_retries - 1:
+            if need_send and attempt < max_retries - 1:
                 print(f"[Python] Waiting {retry_delay} seconds before retry...")
                 time.sleep(retry_delay)
         
-        # 清除超时设置
-        self.socket.setsockopt(zmq.RCVTIMEO, -1)
         raise RuntimeError('Unity handshake failed after all attempts')
         
     def initialize_unity(self):
@@ -88,9 +130,8 @@ class UnityCommunication:
         }
         
         print(f"[Python] Sending initialization config: {self.image_width}x{self.image_height}")
-        self.socket.send_string(json.dumps(config_data))
-        response_str = self.socket.recv_string()
-        response = json.loads(response_str)
+        self._send(config_data)
+        response = orjson.loads(self._recv()[0])
         
         if response.get('status') == 'success':
             print(f"[Python] Unity initialized successfully with image size: {self.image_width}x{self.image_height}")
@@ -98,14 +139,67 @@ class UnityCommunication:
             print(f"[Python] Unity initialization failed: {response.get('message', 'Unknown error')}")
             
     def process_step(self, step_data):
+        """send one render request and wait until its images are handled"""
+        self.submit_step(step_data)
+        self.drain()
+        
+    def submit_step(self, step_data):
+        """send one render request without waiting for the reply
+        
+        replies are handled by poll_responses or drain
+        """
         # 为仿真数据添加消息类型标识
         step_data["message_type"] = "simulation"
         
-        self.socket.send_string(json.dumps(step_data))
-        response_str = self.socket.recv_string()
-        print(f"[Python] Received response string length: {len(response_str)}")
-        print(f"[Python] Raw response (first 200 chars): {response_str[:200]}")
-        response = json.loads(response_str)
+        self._send(step_data)
+        self._pending.append(step_data.get("step"))
+        
+    def poll_responses(self, timeout=0):
+        """handle every reply that has already arrived, returns the number handled
+        
+        timeout (ms) only applies to the first reply, -1 blocks until one arrives
+        """
+        handled = 0
+        while self._pending:
+            frames = self._recv(timeout)
+            if frames is None:
+                break
+            self._handle_reply(frames)
+            handled += 1
+            timeout = 0
+        return handled
+        
+    def drain(self, timeout=None):
+        """wait until every pending render request is answered, returns True if all were
+        
+        timeout (ms) bounds the whole wait, None blocks until unity answers; requests
+        still unanswered at the deadline are logged and left pending
+        """
+        if timeout is None:
+            while self._pending:
+                self.poll_responses(timeout=-1)
+            return True
+        
+        deadline = time.monotonic() + timeout / 1000
+        while self._pending:
+            remaining = int((deadline - time.monotonic()) * 1000)
+            if remaining <= 0:
+                break
+            self.poll_responses(timeout=remaining)
+        if self._pending:
+            log.warning("[Python] No reply from Unity for render steps: %s", list(self._pending))
+            return False
+        return True
+        
+    def _handle_reply(self, frames):
+        """parse one render reply and hand its images to the io pool"""
+        step = self._pending.popleft()
+        # first frame is the json metadata, optional extra frames carry raw png bytes
+        response_bytes = frames[0]
+        log.debug("[Python] Received response length: %d for step %s", len(response_bytes), step)
+        response = orjson.loads(response_bytes)
+        if len(frames) >= 3:
+            response['rgb'], response['segmentation'] = frames[1], frames[2]
         self._check_response(response)
         self.save_image(response)
         
@@ -113,24 +207,24 @@ class UnityCommunication:
     def _check_response(self, response):
         '''
         check the response from unity, is it has image data
-        response_str is a dict from json.loads(response_str)
+        response is a dict parsed from the json reply
         '''
         try:
-            print(f"[Python] Response status: {response.get('status')}")
-            print(f"[Python] Response keys: {list(response.keys())}")
+            log.debug("[Python] Response status: %s", response.get('status'))
+            log.debug("[Python] Response keys: %s", list(response.keys()))
             if 'rgb' in response:
-                print(f"[Python] RGB image data length: {len(response['rgb'])}")
+                log.debug("[Python] RGB image data length: %d", len(response['rgb']))
             else:
-                print("[Python] No RGB image data in response")
+                log.debug("[Python] No RGB image data in response")
             if 'segmentation' in response:
-                print(f"[Python] Segmentation image data length: {len(response['segmentation'])}")
+                log.debug("[Python] Segmentation image data length: %d", len(response['segmentation']))
             else:
-                print("[Python] No segmentation image data in response")  
+                log.debug("[Python] No segmentation image data in response")
                 
             if response.get('status') != 'success':
-                print(f"[Python] Full response: {response}")    
+                log.warning("[Python] Full response: %s", response)
         except Exception as e:
-            print(f"Error checking response: {e}")
+            log.warning("Error checking response: %s", e)
             return None
         
         
@@ -138,15 +232,38 @@ class UnityCommunication:
         '''
         save image data for checking
         two types of image:rgb and segmentation
-        response is a dict from json.loads(response_str)
+        response is a dict parsed from the json reply, image fields hold
+        base64 strings or raw bytes from binary frames
+        images are decoded and written on the io pool, so this returns immediately
         '''
-        rgb_image = base64.b64decode(response['rgb'])
-        rgb_image = Image.open(io.BytesIO(rgb_image))
-        rgb_image.save(os.path.join(self.save_dir, f"step_{response['step']}_rgb.png"))
+        self._io_pool.submit(self._write_image, response['rgb'],
+                             os.path.join(self.save_dir, f"step_{response['step']}_rgb.png"))
+        self._io_pool.submit(self._write_image, response['segmentation'],
+                             os.path.join(self.save_dir, f"step_{response['step']}_segmentation.png"))
+        
+    def _write_image(self, image_data, path):
+        """decode one image and write it to disk, runs on the io pool
         
-        segmentation_image = base64.b64decode(response['segmentation'])
-        segmentation_image = Image.open(io.BytesIO(segmentation_image))
-        segmentation_image.save(os.path.join(self.save_dir, f"step_{response['step']}_segmentation.png"))
+        image_data is raw bytes (or a memoryview) from a binary frame or a base64 string from the json reply
+        png data is written as is, other encodings are converted to png through PIL
+        """
+        try:
+            if isinstance(image_data, str):
+                image_data = base64.b64decode(image_data)
+            if image_data[:8] == PNG_SIGNATURE:
+                with open(path, 'wb') as f:
+                    f.write(image_data)
+                return
+            buffer = getattr(self._io_buffers, 'buffer', None)
+            if buffer is None:
+                buffer = self._io_buffers.buffer = io.BytesIO()
+            buffer.seek(0)
+            buffer.truncate()
+            buffer.write(image_data)
+            buffer.seek(0)
+            Image.open(buffer).save(path)
+        except Exception as e:
+            print(f"[Python] Failed to save image {path}: {e}")
         
     def shutdown(self):
         """Gracefully shutdown the Unity communication
@@ -160,34 +277,37 @@ class UnityCommunication:
                 "message_type": "shutdown"
             }
             
-            # Set a timeout for the shutdown response
-            self.socket.setsockopt(zmq.RCVTIMEO, 5000)  # 5 second timeout
+            # let outstanding render requests finish first, but don't hang on a dead unity
+            self.drain(timeout=5000)
             
             try:
-                self.socket.send_string(json.dumps(shutdown_data))
-                response_str = self.socket.recv_string()
-                response = json.loads(response_str)
+                self._send(shutdown_data)
+                frames = self._recv(timeout=5000)  # 5 second timeout
                 
-                if response.get('status') == 'success':
-                    print("[Python] Unity acknowledged shutdown request")
+                if frames is None:
+                    print("[Python] Unity shutdown response timeout")
                 else:
-                    print(f"[Python] Unity shutdown response: {response}")
+                    response = orjson.loads(frames[0])
+                    if response.get('status') == 'success':
+                        print("[Python] Unity acknowledged shutdown request")
+                    else:
+                        print(f"[Python] Unity shutdown response: {response}")
                     
-            except zmq.Again:
-                print("[Python] Unity shutdown response timeout")
             except Exception as e:
                 print(f"[Python] Error during Unity shutdown: {e}")
                 
         except Exception as e:
             print(f"[Python] Failed to send shutdown request: {e}")
         finally:
-            # Clear the timeout setting
-            self.socket.setsockopt(zmq.RCVTIMEO, -1)
+            # wait for pending image writes
+            self._io_pool.shutdown(wait=True)
             
     def end_process(self):
         """Clean up resources and close connections"""
         try:
-            self.socket.close()
+            self._io_pool.shutdown(wait=True)
+            # drop messages a dead unity will never take, otherwise term() blocks
+            self.socket.close(linger=0)
             self.context.term()
             print("[Python] Unity communication resources cleaned up")
         except Exception as e:
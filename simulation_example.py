@@ -11,6 +11,7 @@ sys.path.insert(0, str(root_dir))
 import base_lettuce_model
 import net_comunication
 from visual_function import VisualFunction
+import numpy as np
 import pandas as pd
 import sys
 from pathlib import Path
@@ -34,7 +35,7 @@ unity_process = subprocess.Popen([
     "-batchmode",
     "-logFile", str(unity_log_path)
 ])
-time.sleep(3) # wait for handshake
+# no fixed wait, UnityCommunication's handshake retries until unity is listening
 
 
 # ============== load parameters and action trajectory =============
@@ -81,26 +82,44 @@ if __name__ == "__main__":
     print("render the first frame")
     unity_communication.process_step(data)
 
+    # render checkpoints: first step of every new day
+    hour_orders = strategy_array[:, 6].astype(int)
+    render_steps = []
+    checkpoint_hour_order = previous_hour_order
+    for i in np.flatnonzero(hour_orders % 24 == 0):
+        if hour_orders[i] != checkpoint_hour_order:
+            render_steps.append(i)
+            checkpoint_hour_order = hour_orders[i]
+
     start_time = time.time()
-    for i in range(len(strategy_array)):
+    start = 0
+    for i in render_steps:
+        # save images of renders that finished while the dynamics were stepping
+        unity_communication.poll_responses()
+        # advance the dynamics up to and including the checkpoint step in one call
+        lettuce_dry_weight_dynamic.step_many(strategy_array[start:i + 1, :4])
+        start = i + 1
         actions = strategy_array[i, :4]
-        hour_order = int(strategy_array[i, 6])
-        lettuce_dry_weight_dynamic.step(actions)
-
-        if hour_order % 24 == 0 and hour_order != previous_hour_order:
-            print(f'dw is {lettuce_dry_weight_dynamic.state.sum()} g per plant')
-            print(f"hour_order changed from {previous_hour_order} to {hour_order}")
-            current_day = hour_order // 24
-
-            data = visual_function.render_calculation(
-                dw=lettuce_dry_weight_dynamic.state.sum(),
-                plant_density=int(actions[3]),
-                timestep=hour_order,
-                day=current_day
-            )
-
-            unity_communication.process_step(data)
-            previous_hour_order = hour_order
+        hour_order = int(hour_orders[i])
+
+        print(f'dw is {lettuce_dry_weight_dynamic.state.sum()} g per plant')
+        print(f"hour_order changed from {previous_hour_order} to {hour_order}")
+        current_day = hour_order // 24
+
+        data = visual_function.render_calculation(
+            dw=lettuce_dry_weight_dynamic.state.sum(),
+            plant_density=int(actions[3]),
+            timestep=hour_order,
+            day=current_day
+        )
+
+        # fire the render request and keep simulating, the reply is harvested later
+        unity_communication.submit_step(data)
+        previous_hour_order = hour_order
+
+    # remaining steps after the last checkpoint
+    lettuce_dry_weight_dynamic.step_many(strategy_array[start:, :4])
+    unity_communication.drain(timeout=5000)
 
     # ======= turn off unity =======
     try:
@@ -2,13 +2,17 @@
 Take dw and plant density as input
 Return json info for Unity
 '''
+from typing import Dict, Tuple
 import numpy as np
-from numba import jit, njit, float64, int64
+from numba import njit, float64, int64
 
 # 预编译参数数组，优化性能
 PARAMS_SMALL = np.array([7.985305504553652, 291.73135988978663, -707.7401261511758, 772.4044195923515])
 PARAMS_LARGE = np.array([30.9961439725485, 76.16800558950729, -6.5045717125301445, 0.26365904070466195])
 
+# number of render frames covered by one refill of the random rotation/scale pools
+RANDOM_POOL_FRAMES = 64
+
 @njit
 def _3_degree_polynomial(x, params):
     return params[0] + x * (params[1] + x * (params[2] + x * params[3]))
@@ -29,7 +33,6 @@ def _calculate_scale(dw: float):
     return radiu_based_scale
 
 
-@jit(nopython=True)
 def _coordinate_calculation_vectorized(plant_density, L=10, W=10): 
     """Calculate grid-based coordinates that completely fill a rectangular area
     
@@ -63,56 +66,71 @@ def _coordinate_calculation_vectorized(plant_density, L=10, W=10):
     x_values = np.linspace(-L/2, L/2, n_cols)  # remove endpoint parameter
     z_values = np.linspace(-W/2, W/2, n_rows)  # remove endpoint parameter
     
-    # create the result array
-    total_grid_points = n_cols * n_rows
-    x_positions = np.empty(total_grid_points, dtype=np.float64)
-    z_positions = np.empty(total_grid_points, dtype=np.float64)
-    
-    # fill the coordinates
-    idx = 0
-    for z in z_values:
-        x_positions[idx:idx+n_cols] = x_values
-        z_positions[idx:idx+n_cols] = z
-        idx += n_cols
+    # fill the grid row by row (z outer, x inner) with numpy's contiguous copy path;
+    # called once per render, so this is plain numpy rather than jit
+    x_grid, z_grid = np.meshgrid(x_values, z_values)
     
-    return x_positions, z_positions
+    return x_grid.ravel(), z_grid.ravel()
     
     
 class VisualFunction:
     def __init__(self,            
                  L = 0.1,
-                 W = 0.1):
+                 W = 0.1,
+                 seed = None,
+                 debug = False):
         # panel size for 1m^2
         self.L = L
         self.W = W
+        # print per-render diagnostics
+        self.debug = debug
+        # random rotation/scale factors are drawn in bulk and sliced per frame
+        self._rng = np.random.default_rng(seed)
+        self._rot_pool = None
+        self._scale_pool = None
+        self._pool_offset = 0
+        # grid coordinates keyed by (plant_density, L, W), density rarely changes between renders
+        self._coord_cache: Dict[Tuple[int, float, float], Tuple[np.ndarray, np.ndarray]] = {}
         # TODO, adding environment factors for illumination render in next step
     
     def render_calculation(self, dw, plant_density, timestep, day=0):
-        print(f"view scale: {self.L} {self.W}")
         scale = _calculate_scale(dw)/6
         # upscale the scale to unity scale
-        print(f"scale: {scale}")
+        if self.debug:
+            print(f"view scale: {self.L} {self.W}")
+            print(f"scale: {scale}")
         # develop a dw-based random function for scale, large dw, large random
 
-        x_positions, z_positions = _coordinate_calculation_vectorized(plant_density, self.L, self.W)
+        key = (plant_density, self.L, self.W)
+        coordinates = self._coord_cache.get(key)
+        if coordinates is None:
+            coordinates = _coordinate_calculation_vectorized(plant_density, self.L, self.W)
+            for array in coordinates:
+                array.setflags(write=False)
+            self._coord_cache[key] = coordinates
+        x_positions, z_positions = coordinates
         
         total_plant_number = len(x_positions)
-        random_rotation = np.random.uniform(-40.0, 40.0, total_plant_number) #-10 to 10 is reasonable align with obervation
-        random_scale = np.random.uniform(0.85, 1.15, total_plant_number) #0.95 to 1.1 is reasonable align with obervation
-      # create the lettuce data in format for unity
-        lettuces = []
-        for i in range(total_plant_number):
-            lettuce = {
+        random_rotation, random_scale = self._draw_random(total_plant_number)
+        # convert the per-plant arrays to python floats in bulk, instead of boxing element by element
+        xs = x_positions.tolist()
+        zs = z_positions.tolist()
+        rotations = random_rotation.tolist()
+        scales = (scale * random_scale).tolist()  # now is actual scale
+        # create the lettuce data in format for unity, one pass over the per-plant lists
+        lettuces = [
+            {
                 "id": i,
                 "position": {
-                    "x": float(x_positions[i]),
+                    "x": x,
                     "y": 0,
-                    "z": float(z_positions[i])
+                    "z": z
                 },
-                'rotation': float(random_rotation[i]),
-                "scale": float(scale * random_scale[i])  # now is actual scale
+                'rotation': rotation,
+                "scale": plant_scale
             }
-            lettuces.append(lettuce)
+            for i, (x, z, rotation, plant_scale) in enumerate(zip(xs, zs, rotations, scales))
+        ]
         
         data = {
             "lettuces": lettuces,
@@ -121,11 +139,35 @@ class VisualFunction:
         }
         
         #add debug info
-        #print(f"[Python] Generated {len(lettuces)} lettuces")
-        #print(f"[Python] Sample positions: {lettuces[0]['position'] if lettuces else 'No lettuces'}")
+        if self.debug:
+            print(f"[Python] Generated {len(lettuces)} lettuces")
+            print(f"[Python] Sample positions: {lettuces[0]['position'] if lettuces else 'No lettuces'}")
         
         return data
 
+    def _draw_random(self, n):
+        """Slice per-plant rotation and scale factors for one frame from the pools
+        
+        The pools hold RANDOM_POOL_FRAMES frames worth of values and are refilled
+        in place once depleted. The returned arrays are views, valid until the next call.
+        """
+        if self._rot_pool is None or self._pool_offset + n > len(self._rot_pool):
+            pool_size = RANDOM_POOL_FRAMES * n
+            if self._rot_pool is None or len(self._rot_pool) != pool_size:
+                self._rot_pool = np.empty(pool_size)
+                self._scale_pool = np.empty(pool_size)
+            # uniform(a, b) = a + (b - a) * U[0, 1), filled without temporaries
+            self._rng.random(out=self._rot_pool)
+            self._rot_pool *= 80.0
+            self._rot_pool -= 40.0  # -40 to 40, -10 to 10 is reasonable align with obervation
+            self._rng.random(out=self._scale_pool)
+            self._scale_pool *= 0.3
+            self._scale_pool += 0.85  # 0.85 to 1.15, 0.95 to 1.1 is reasonable align with obervation
+            self._pool_offset = 0
+        start = self._pool_offset
+        self._pool_offset += n
+        return self._rot_pool[start:start + n], self._scale_pool[start:start + n]
+
     
     
 if __name__ == "__main__":
@@ -133,7 +175,7 @@ if __name__ == "__main__":
     plant_density = 100
     L = 1
     W = 1
-    visual_function = VisualFunction(L, W)
+    visual_function = VisualFunction(L, W, debug=True)
     data = visual_function.render_calculation(0, plant_density, 0)
     print(data)
     dw = 0.04